@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import os
+import re
 import sys
 from playwright.async_api import BrowserContext, async_playwright
 from config.browser_config import BROWSER_ARGS, CONTEXT_CONFIG
@@ -15,10 +16,20 @@ from environments.capture import OfflineCaptureManager
 
 logger = logging.getLogger(__name__)
 
+# Common noisy browser console warnings that are not worth printing
+_NOISY_CONSOLE_MESSAGES = re.compile(
+    r"Blocked script execution in"
+    r"|Failed to execute 'postMessage'"
+    r"|Failed to load resource: net::ERR_NAME_NOT_RESOLVED"
+)
+# How long close() waits for in-flight request/response recording
+_LISTENER_DRAIN_TIMEOUT = 5.0
+
 
 class StealthBrowser:
     def __init__(self):
         self.playwright = None
+        self.browser = None
         self.context = None
         self.page = None
         self.recorder = Recorder()
@@ -32,26 +43,51 @@ class StealthBrowser:
         self._binding_registered = False
         self._page_script_registered = False
 
+        # Track network listener tasks so close() can wait for them to finish
+        self._listener_tasks = set()
+        self._on_request = self._offload(self.request_event_handler.listen)
+        self._on_response = self._offload(self.response_event_handler.listen)
+
+    def _offload(self, listener):
+        """Run an async listener in its own tracked task for each event.
+
+        Playwright already runs coroutine listeners as tasks, this wrapper only
+        keeps hold of them so close() can await the ones still in flight.
+        """
+
+        def _schedule(event):
+            # Keep a strong reference until done, the loop only holds weak ones
+            task = asyncio.create_task(listener(event))
+            self._listener_tasks.add(task)
+            task.add_done_callback(self._listener_tasks.discard)
+
+        return _schedule
+
     async def launch(self):
         """Launch stealth browser"""
         self.playwright = await async_playwright().start()
+        Recorder.start_step_writer()
 
         task_manager = TaskManager()
         task = task_manager.get_current_task()
 
         self.context = await self.launch_browser(task.id)
-        await self.environment_capturer.start(self.context)
-        self.context.on("request", self.request_event_handler.listen)
-        self.context.on("response", self.response_event_handler.listen)
-
-        # Ensure bindings/scripts for any subsequent pages/documents
-        await self.setup_context_dom_listeners()
+        self.context.on("request", self._on_request)
+        self.context.on("response", self._on_response)
+
+        # Ensure bindings/scripts for any subsequent pages/documents, these are
+        # independent of each other so install them concurrently
+        await asyncio.gather(
+            self.environment_capturer.start(self.context),
+            self.apply_stealth_techniques(),
+            self.setup_context_dom_listeners(),
+        )
         self.page = await self.context.new_page()
         await self.playwright_page_handler.attach(self.page)
 
         # Track new tab/page creation
         async def on_page_created(page):
-            await self.recorder.record_step(
+            await self.recorder.enqueue_step(
                 {
                     "event_info": {
                         "event_type": "tab_opened",
@@ -77,31 +113,25 @@ class StealthBrowser:
         async def console_handler(msg):
             # Skip common noisy warnings
             text = msg.text
-            if "Blocked script execution in 'about:blank'" in text:
-                return
-            if "Failed to execute 'postMessage'" in text:
-                return
-            if "Blocked script execution in" in text:
-                return
-            if "Failed to load resource: net::ERR_NAME_NOT_RESOLVED" in text:
+            if _NOISY_CONSOLE_MESSAGES.search(text):
                 return
             print(f"🌐 Browser console: {text}")
 
         self.page.on("console", console_handler)
 
-        await self.apply_stealth_techniques()
         await self.setup_per_page_dom_listeners(self.page)
 
         return self.page
 
     async def apply_stealth_techniques(self):
-        """Apply stealth techniques to avoid detection"""
-        await self.page.add_init_script(STEALTH_SCRIPT)
+        """Apply stealth techniques to avoid detection on every page of the context"""
+        await self.context.add_init_script(STEALTH_SCRIPT)
 
     async def setup_context_dom_listeners(self):
         """Setup context-level DOM event listeners"""
         print("🔧 Setting up DOM listeners...")
 
+        pending = []
         if not self._binding_registered:
 
             async def _on_page_event(source, event_info):
@@ -117,41 +147,45 @@ class StealthBrowser:
                     )
 
             # Expose at context-level
-            await self.context.expose_binding("onPageEvent", _on_page_event)
-            self._binding_registered = True
+            pending.append(self.context.expose_binding("onPageEvent", _on_page_event))
 
         if not self._page_script_registered:
             # Ensure scripts initialize before any content
-            await self.context.add_init_script(PAGE_EVENT_LISTENER_SCRIPT)
-            self._page_script_registered = True
+            pending.append(self.context.add_init_script(PAGE_EVENT_LISTENER_SCRIPT))
+
+        await asyncio.gather(*pending)
+        self._binding_registered = True
+        self._page_script_registered = True
 
         print("✅ DOM listeners setup complete")
 
     async def setup_per_page_dom_listeners(self, page):
-        """Fallback to page-level binding if context-level binding is not available"""
-        if not page:
+        """Fallback to page-level listener injection if the context-level one did not run"""
+        if not page or getattr(page, "_pe_injected", False):
             return
         try:
-            # Expose at page-level as a fallback (useful for certain CSP/isolated worlds)
-            try:
-
-                async def _page_binding(source, event_info):
-                    p = getattr(source, "page", None)
-                    await self.handle_dom_change_event(event_info, p)
-
-                await page.expose_binding("onPageEvent", _page_binding)
-            except Exception:
-                pass
-            await page.evaluate(PAGE_EVENT_LISTENER_SCRIPT)
-            try:
-                # Also try to install on existing frames
-                for frame in page.frames:
-                    try:
-                        await frame.evaluate(PAGE_EVENT_LISTENER_SCRIPT)
-                    except Exception:
-                        pass
-            except Exception:
-                pass
+            # The context init script already runs on every frame/document, only
+            # inject the listener by hand when it demonstrably did not run here
+            injected = await page.evaluate(
+                "() => window.__RECORDER_EVENT_LISTENER_LOADED__ === true"
+            )
+            if not injected:
+                # onPageEvent is always exposed on the context before any page is
+                # set up (a page-level expose_binding of the same name would raise),
+                # and the listener queues events until the binding is reachable
+                await page.add_init_script(PAGE_EVENT_LISTENER_SCRIPT)
+                # Inject as a script element rather than evaluating the source, so
+                # V8 compiles it as a regular script instead of through eval
+                await page.evaluate(
+                    """(src) => {
+                        const s = document.createElement('script');
+                        s.textContent = src;
+                        (document.head || document.documentElement).appendChild(s);
+                        s.remove();
+                    }""",
+                    PAGE_EVENT_LISTENER_SCRIPT,
+                )
+            setattr(page, "_pe_injected", True)
         except Exception as exc:
             logger.error("[PAGE_EVENT] Failed to initialize listener script: %s", exc)
 
@@ -162,23 +196,43 @@ class StealthBrowser:
             event_context = event_info.get("event_context", "unknown")
             logger.debug(f"[PAGE_EVENT] Received: {event_context}:{event_type}")
 
-            await self.recorder.record_step(
-                {
-                    "event_info": event_info,
-                    "prefix_action": f"{event_context}",
-                    "source_page": page,
-                }
-            )
+            step_info = {
+                "event_info": event_info,
+                "prefix_action": f"{event_context}",
+                "source_page": page,
+            }
+
+            # Queue the event so the binding returns right away, it only waits
+            # when the step writer falls behind and the queue is full
+            await self.recorder.enqueue_step(step_info)
         except Exception as e:
             logger.error(f"[PAGE_EVENT] Error handling event: {e}", exc_info=True)
 
+    async def _drain_listener_tasks(self):
+        """Let pending request/response recording finish, cancel what is left"""
+        if not self._listener_tasks:
+            return
+        _, pending = await asyncio.wait(
+            set(self._listener_tasks), timeout=_LISTENER_DRAIN_TIMEOUT
+        )
+        if pending:
+            logger.warning(
+                f"[CLOSE] Cancelling {len(pending)} unfinished network listeners"
+            )
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
     async def close(self):
         """Close browser"""
         logger.info("[CLOSE] Starting browser close sequence...")
 
+        # Record any steps still queued while the pages are alive
+        await Recorder.stop_step_writer()
+
         self.playwright_page_handler.detach_all_page_listeners()
-        self.context.remove_listener("request", self.request_event_handler.listen)
-        self.context.remove_listener("response", self.response_event_handler.listen)
+        self.context.remove_listener("request", self._on_request)
+        self.context.remove_listener("response", self._on_response)
 
         for page in self.context.pages:
             try:
@@ -187,8 +241,12 @@ class StealthBrowser:
                 pass
 
         await asyncio.sleep(0.5)
+        await self._drain_listener_tasks()
         await self.environment_capturer.stop()
         await self.context.close()
+        if self.browser:
+            await self.browser.close()
+            self.browser = None
         await self.playwright.stop()
 
         logger.info("[CLOSE] Browser close sequence completed")
@@ -204,14 +262,15 @@ class StealthBrowser:
             "--password-store=basic",
         ]
 
-        browser = await self.playwright.chromium.launch(
+        self.browser = await self.playwright.chromium.launch(
             channel=preferred_channel,
             headless=False,
             args=BROWSER_ARGS,
             ignore_default_args=ignore_default_args,
         )
 
-        self.context = await browser.new_context(
+        # The caller owns the context reference, it is only assigned once there
+        return await self.browser.new_context(
             **CONTEXT_CONFIG,
             bypass_csp=True,
             record_video_dir=get_video_path(task_id),
@@ -219,7 +278,6 @@ class StealthBrowser:
             record_har_path=self.environment_capturer.get_har_path(task_id),
             record_har_mode="full",
         )
-        return self.context
 
     async def manual_browser_close(self):
         logger.info("Browser closed manually")
@@ -22,7 +22,7 @@ class PlaywrightPageEvent:
             # Bind page at definition time to avoid late-binding issues
             async def on_domcontentloaded(p=page):
                 # logger.info(f"[PAGE_EVENT] DOM content loaded for {p.url}")
-                await self.recorder.record_step(
+                await self.recorder.enqueue_step(
                     {
                         "event_info": {
                             "event_type": "domcontentloaded",
@@ -39,7 +39,7 @@ class PlaywrightPageEvent:
                 # Scripts are already injected by context.add_init_script
 
                 # Record page load as a high-level event
-                await self.recorder.record_step(
+                await self.recorder.enqueue_step(
                     {
                         "event_info": {
                             "event_type": "loaded",
@@ -55,7 +55,7 @@ class PlaywrightPageEvent:
                 if frame == p.main_frame:  # Only track main frame navigation
                     # logger.info(f"[PAGE_EVENT] Main frame navigated to {frame.url}")
                     # Scripts are already injected by context.add_init_script
-                    await self.recorder.record_step(
+                    await self.recorder.enqueue_step(
                         {
                             "event_info": {
                                 "event_type": "navigated",
@@ -70,7 +70,7 @@ class PlaywrightPageEvent:
 
             async def on_close(p=page):
                 # logger.info(f"[PAGE_EVENT] Tab/page closed: {p.url}")
-                await self.recorder.record_step(
+                await self.recorder.enqueue_step(
                     {
                         "event_info": {
                             "event_type": "tab_closed",
@@ -52,7 +52,7 @@ class RequestEvent:
         except Exception:
             return None
 
-    def listen(self, request):
+    async def listen(self, request):
         if not request or request.resource_type not in ("xhr", "fetch", "document"):
             return
 
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import json
 import logging
@@ -44,6 +45,12 @@ class Recorder:
         ("action:user", "submit"),
     }
     _MAX_SNAPSHOT_NODES = 400
+    _STEP_QUEUE_SIZE = 1024
+
+    # Shared by every Recorder instance so all steps are stored (and get their
+    # ids) in the order their events arrived, whichever handler produced them
+    _step_queue: Optional[asyncio.Queue] = None
+    _step_writer: Optional[asyncio.Task] = None
 
     def __init__(self):
         self.db = Database.get_instance()
@@ -52,9 +59,15 @@ class Recorder:
         self.step_manager = StepManager()
         self._cdp_session = None
 
-    async def record_step(self, step_info: dict, omit_screenshot: bool = False):
+    async def record_step(
+        self,
+        step_info: dict,
+        omit_screenshot: bool = False,
+        timestamp: Optional[str] = None,
+    ):
         try:
-            timestamp = get_iso_datetime()
+            # Queued steps carry the time the event happened, not when it is written
+            timestamp = timestamp or get_iso_datetime()
             actual_task = self.task_manager.get_current_task()
 
             if not actual_task:
@@ -141,6 +154,45 @@ class Recorder:
         except Exception as e:
             logger.error(f"[RECORD_STEP] Failed to record step: {e}", exc_info=True)
 
+    async def enqueue_step(self, step_info: dict, omit_screenshot: bool = False):
+        """Queue a step for the shared writer, or record it right away if none runs"""
+        if Recorder._step_writer is None:
+            await self.record_step(step_info, omit_screenshot=omit_screenshot)
+            return
+        await Recorder._step_queue.put(
+            (self, step_info, omit_screenshot, get_iso_datetime())
+        )
+
+    @classmethod
+    def start_step_writer(cls):
+        """Start recording queued steps in a background task"""
+        if cls._step_writer is not None:
+            return
+        cls._step_queue = asyncio.Queue(maxsize=cls._STEP_QUEUE_SIZE)
+        cls._step_writer = asyncio.create_task(cls._write_queued_steps())
+
+    @classmethod
+    async def stop_step_writer(cls):
+        """Record every step queued so far, then stop the background writer"""
+        writer = cls._step_writer
+        if writer is None:
+            return
+        # Steps arriving from now on are recorded directly
+        cls._step_writer = None
+        await cls._step_queue.put(None)
+        await writer
+
+    @classmethod
+    async def _write_queued_steps(cls):
+        while True:
+            item = await cls._step_queue.get()
+            if item is None:
+                return
+            recorder, step_info, omit_screenshot, timestamp = item
+            await recorder.record_step(
+                step_info, omit_screenshot=omit_screenshot, timestamp=timestamp
+            )
+
     def _normalize_event_data(self, data: Any) -> Dict[str, Any]:
         if isinstance(data, dict):
             return data
@@ -477,3 +477,19 @@ if (!window.__RECORDER_EVENT_LISTENER_LOADED__) {
   try { flushQueuedEvents(); } catch (_) {}
 }
 """
+
+REPLAY_SCROLL_SCRIPT = """
+window.__replayScroll = window.__replayScroll || ((x, y) => {
+  // Try multiple methods to ensure scroll happens
+  window.scrollTo({ left: x, top: y, behavior: 'instant' });
+  // Fallback for older browsers
+  if (window.scrollX !== x || window.scrollY !== y) {
+    window.scrollTo(x, y);
+  }
+  // Also try scrolling document element directly
+  if (document.documentElement) {
+    document.documentElement.scrollLeft = x;
+    document.documentElement.scrollTop = y;
+  }
+});
+"""
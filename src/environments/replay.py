@@ -1,12 +1,39 @@
 import asyncio
 import logging
-from typing import Any, Dict, Optional, Tuple
-from urllib.parse import urlparse
-from playwright.async_api import Page, Locator, TimeoutError as PlaywrightTimeoutError
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import ParseResult, urlparse
+from playwright.async_api import BrowserContext, Page, Locator
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import Error as PlaywrightError
 from db.models import StepModel
+from config.browser_scripts import REPLAY_SCROLL_SCRIPT
 
 
+ActionHandler = Callable[[Page, Dict[str, Any]], Awaitable[None]]
+StateHandler = Callable[[Page, StepModel, Dict[str, Any]], Awaitable[None]]
+# A step paired with its event data, parsed once when the trajectory is loaded
+ReplayStep = Tuple[StepModel, Dict[str, Any]]
 logger = logging.getLogger(__name__)
+
+
+# Trajectories only use a handful of distinct event types, so cache the split
+@lru_cache(maxsize=256)
+def _split_event_type(event_type: str) -> Tuple[str, str, str]:
+    parts = (event_type or "").split(":", 2)
+    if len(parts) == 1:
+        return parts[0], "", ""
+    if len(parts) == 2:
+        return parts[0], parts[1], ""
+    return parts[0], parts[1], parts[2]
+
+
+# Replays keep navigating between the same few URLs, so cache their parsing
+@lru_cache(maxsize=512)
+def _cached_urlparse(url: str) -> ParseResult:
+    return urlparse(url)
+
+
 # TODO: potential fixes to debug if failing
 # - is the CSS scaping enough given our usecase?
 # - is URLs differ to simple given the purpose of this? which is replicating a set of human trajectory steps from the DB
@@ -18,17 +45,43 @@ class TaskStepExecutor:
     def __init__(
         self, trajectory: list[StepModel], *, run_human_trajectory: bool = False
     ) -> None:
-        self.trajectory: list[StepModel] = trajectory
         self.run_human_trajectory: bool = run_human_trajectory
         self._initial_navigation_done: bool = False
+        self._scroll_helper_context: Optional[BrowserContext] = None
+        self._state_steps: Dict[Tuple[str, str], StateHandler] = {
+            ("browser", "navigated"): self._perform_navigation,
+            ("page", "domcontentloaded"): self._wait_for_domcontentloaded,
+            ("page", "domcontentload"): self._wait_for_domcontentloaded,
+            ("page", "loaded"): self._wait_for_load,
+            ("page", "load"): self._wait_for_load,
+        }
+        self._user_actions: Dict[str, ActionHandler] = {
+            "click": self._perform_pointer_click,
+            "hover": self._perform_pointer_move,
+            "scroll": self._perform_scroll,
+            "input": self._perform_input,
+            "keydown": self._perform_keydown,
+            "submit": self._perform_submit,
+        }
+        # event_data_json parses the stored JSON on every access, read it only once
+        steps: list[ReplayStep] = []
+        for step in trajectory:
+            payload: Any = step.event_data_json
+            if not self._is_noop_step(step, payload):
+                steps.append((step, payload))
+        if len(steps) != len(trajectory):
+            logger.debug("Skipping %d no-op steps", len(trajectory) - len(steps))
+        self.trajectory: list[ReplayStep] = self._coalesce_bursts(steps)
+        self._tag_spa_routes(self.trajectory)
 
     async def run(self, page: Page) -> None:
         if page.url and page.url != "about:blank":
             self._initial_navigation_done = True
+        await self._install_scroll_helper(page)
 
-        for step in self.trajectory:
+        for step, payload in self.trajectory:
             try:
-                await self._run_step(page, step)
+                await self._run_step(page, step, payload)
             except Exception as exc:
                 logger.error(
                     "Failed to execute step %s (%s): %s. Stopping trajectory replay.",
@@ -38,61 +91,86 @@ class TaskStepExecutor:
                     exc_info=True,
                 )
                 return
-            base_delay: float = 0.2 if self.run_human_trajectory else 0.1
-            await asyncio.sleep(base_delay)
+            delay: float = self._step_delay(step.event_type)
+            if delay:
+                await asyncio.sleep(delay)
 
-    async def _run_step(self, page: Page, step: StepModel) -> None:
-        category, subject, action = self._split_event_type(step.event_type)
+    async def _install_scroll_helper(self, page: Page) -> None:
+        # Register once per context for every future document, init scripts
+        # accumulate so repeated runs must not add it again
+        try:
+            if self._scroll_helper_context is not page.context:
+                await page.context.add_init_script(REPLAY_SCROLL_SCRIPT)
+                self._scroll_helper_context = page.context
+            await page.evaluate(REPLAY_SCROLL_SCRIPT)
+        except PlaywrightError as exc:
+            logger.warning("Failed to install scroll helper: %s", exc)
+
+    def _step_delay(self, event_type: str) -> float:
+        category, _, action = _split_event_type(event_type)
+        if category == "state":
+            # State steps already wait on the page themselves
+            return 0.0
+        base_delay: float = ACTION_DELAYS.get(action, 0.1)
+        return base_delay * 2 if self.run_human_trajectory else base_delay
+
+    async def _run_step(
+        self, page: Page, step: StepModel, payload: Dict[str, Any]
+    ) -> None:
+        category, subject, action = _split_event_type(step.event_type)
 
         if category == "state":
-            await self._handle_state_step(page, subject, action, step.event_data_json)
+            await self._handle_state_step(page, subject, action, step, payload)
             return
 
         if category == "action" and subject == "user":
-            await self._handle_user_action(page, action, step.event_data_json)
+            await self._handle_user_action(page, action, payload)
 
     async def _handle_state_step(
-        self, page: Page, subject: str, action: str, payload: Dict[str, Any]
+        self,
+        page: Page,
+        subject: str,
+        action: str,
+        step: StepModel,
+        payload: Dict[str, Any],
     ) -> None:
-        if subject == "browser" and action == "navigated":
-            url = payload.get("url") if isinstance(payload, dict) else None
-            if not url or url == "about:blank":
-                return
-            if not self._initial_navigation_done or self._urls_differ(page.url, url):
-                # Check if this is a SPA route change vs real navigation
-                if await self._is_spa_route_change(page, url):
-                    await self._perform_spa_navigation(page, url)
-                else:
-                    await self._safe_goto(page, url)
-                self._initial_navigation_done = True
-            return
-
-        if subject == "page":
-            if action in {"domcontentloaded", "domcontentload"}:
-                await self._safe_wait_for_load(page, "domcontentloaded")
-            elif action in {"loaded", "load"}:
-                await self._safe_wait_for_load(page, "load")
+        handler: Optional[StateHandler] = self._state_steps.get((subject, action))
+        if handler:
+            await handler(page, step, payload)
 
     async def _handle_user_action(
         self, page: Page, action: str, payload: Dict[str, Any]
     ) -> None:
-        if action == "click":
-            await self._perform_pointer_click(page, payload)
-            return
-        if action == "hover":
-            await self._perform_pointer_move(page, payload)
-            return
-        if action == "scroll":
-            await self._perform_scroll(page, payload)
-            return
-        if action == "input":
-            await self._perform_input(page, payload)
-            return
-        if action == "keydown":
-            await self._perform_keydown(page, payload)
+        handler: Optional[ActionHandler] = self._user_actions.get(action)
+        if handler:
+            await handler(page, payload)
+
+    async def _perform_navigation(
+        self, page: Page, step: StepModel, payload: Dict[str, Any]
+    ) -> None:
+        url = payload.get("url")
+        if not url or url == "about:blank":
             return
-        if action == "submit":
-            await self._perform_submit(page, payload)
+        if not self._initial_navigation_done or self._urls_differ(page.url, url):
+            # Check if this is a SPA route change vs real navigation
+            spa_route: Optional[bool] = getattr(step, "spa_route", None)
+            if spa_route is None:
+                spa_route = await self._is_spa_route_change(page, url)
+            if spa_route:
+                await self._perform_spa_navigation(page, url)
+            else:
+                await self._safe_goto(page, url)
+            self._initial_navigation_done = True
+
+    async def _wait_for_domcontentloaded(
+        self, page: Page, step: StepModel, payload: Dict[str, Any]
+    ) -> None:
+        await self._safe_wait_for_load(page, "domcontentloaded")
+
+    async def _wait_for_load(
+        self, page: Page, step: StepModel, payload: Dict[str, Any]
+    ) -> None:
+        await self._safe_wait_for_load(page, "load")
 
     async def _perform_pointer_click(self, page: Page, payload: Dict[str, Any]) -> None:
         coords: Optional[Tuple[float, float]] = self._extract_coordinates(payload)
@@ -133,36 +211,21 @@ class TaskStepExecutor:
         if isinstance(x, (int, float)) and isinstance(y, (int, float)):
             try:
                 # Use evaluate for absolute scroll positioning (acceptable use case per Playwright docs)
-                # as there's no direct API for setting exact scroll coordinates
+                # as there's no direct API for setting exact scroll coordinates; the helper is
+                # preinstalled by _install_scroll_helper so only the coordinates go over the wire,
+                # documents it did not reach (e.g. failed install) fall back to a plain scrollTo
                 await page.evaluate(
-                    """(coords) => {
-                        // Try multiple methods to ensure scroll happens
-                        window.scrollTo({
-                            left: coords.x,
-                            top: coords.y,
-                            behavior: 'instant'
-                        });
-                        // Fallback for older browsers
-                        if (window.scrollX !== coords.x || window.scrollY !== coords.y) {
-                            window.scrollTo(coords.x, coords.y);
-                        }
-                        // Also try scrolling document element directly
-                        if (document.documentElement) {
-                            document.documentElement.scrollLeft = coords.x;
-                            document.documentElement.scrollTop = coords.y;
-                        }
-                    }""",
-                    {"x": x, "y": y},
+                    "([x, y]) => (window.__replayScroll"
+                    " || ((x, y) => window.scrollTo(x, y)))(x, y)",
+                    [x, y],
                 )
-            except Exception as exc:
+            except PlaywrightError as exc:
                 logger.warning("Failed to scroll to (%s, %s): %s", x, y, exc)
         else:
             logger.warning("Invalid scroll coordinates: x=%s, y=%s", x, y)
 
     async def _perform_input(self, page: Page, payload: Dict[str, Any]) -> None:
-        value: Optional[str] = (
-            payload.get("value") if isinstance(payload, dict) else None
-        )
+        value: Optional[str] = payload.get("value")
         if value is None:
             return
 
@@ -183,7 +246,7 @@ class TaskStepExecutor:
             if await focused_locator.count() > 0:
                 await focused_locator.fill(value, timeout=2000)
                 return
-        except Exception as exc:
+        except PlaywrightError as exc:
             logger.error("Failed to fill focused element: %s", exc)
 
         # If we get here, both attempts failed
@@ -195,12 +258,12 @@ class TaskStepExecutor:
         raise Exception("Input operation failed")
 
     async def _perform_keydown(self, page: Page, payload: Dict[str, Any]) -> None:
-        key: Optional[str] = payload.get("key") if isinstance(payload, dict) else None
+        key: Optional[str] = payload.get("key")
         if not key:
             return
         try:
             await page.keyboard.press(key)
-        except Exception:
+        except PlaywrightError:
             await page.keyboard.type(key)
 
     async def _perform_submit(self, page: Page, payload: Dict[str, Any]) -> None:
@@ -209,12 +272,17 @@ class TaskStepExecutor:
 
         try:
             if selector:
-                # Try pressing Enter on the form element
+                # Try pressing Enter on the form element directly, the action
+                # auto-waits for it so a missing element surfaces as a timeout
                 form_locator: Locator = page.locator(selector)
-                if await form_locator.count() > 0:
+                try:
                     await form_locator.press("Enter", timeout=2000)
                     return
+                except PlaywrightTimeoutError:
+                    pass
 
+            # The fallbacks are guesses that are often absent, probe them with
+            # count() so a miss returns at once instead of waiting for a timeout.
             # Try to find and click a submit button
             submit_button: Locator = page.locator(
                 'button[type="submit"], input[type="submit"]'
@@ -238,11 +306,39 @@ class TaskStepExecutor:
             # If we reach here, no submit method worked
             logger.error("Submit failed: no form element found to submit")
             raise Exception("Submit operation failed")
-        except Exception as exc:
+        except PlaywrightError as exc:
             logger.error("Failed to submit form: %s", exc, exc_info=True)
             raise
 
+    def _tag_spa_routes(self, trajectory: list[ReplayStep]) -> None:
+        """
+        Decide SPA route change vs real navigation for each navigation step up front.
+
+        Every navigation is judged against the previously navigated URL of the
+        trajectory and the decision is stored as ``step.spa_route``. The first one
+        has no predecessor and a repeat of the previous URL is a reload rather than
+        a route change, both are tagged None and decided at replay time against
+        the actual page URL.
+        """
+        current_url: Optional[str] = None
+        for step, payload in trajectory:
+            if step.event_type != "state:browser:navigated":
+                continue
+            url: Any = payload.get("url")
+            if not url or url == "about:blank":
+                continue
+            step.spa_route = (
+                self._is_spa_route(current_url, url)
+                if current_url and current_url != url
+                else None
+            )
+            current_url = url
+
     async def _is_spa_route_change(self, page: Page, target_url: str) -> bool:
+        return self._is_spa_route(page.url, target_url)
+
+    @staticmethod
+    def _is_spa_route(current_url: Optional[str], target_url: str) -> bool:
         """
         Detect if a navigation is likely a SPA client-side route change.
 
@@ -251,13 +347,14 @@ class TaskStepExecutor:
         2. Only hash differs, OR
         3. Path/query differs but it's on the same domain (likely client-side routing)
         """
-        current_url = page.url
         if not current_url or current_url == "about:blank":
             return False
+        if current_url == target_url:
+            return True  # Same URL, nothing to reload
 
         try:
-            current = urlparse(current_url)
-            target = urlparse(target_url)
+            current = _cached_urlparse(current_url)
+            target = _cached_urlparse(target_url)
 
             # Different origins = real navigation
             if current.scheme != target.scheme or current.netloc != target.netloc:
@@ -276,16 +373,15 @@ class TaskStepExecutor:
             # For same-origin path changes, assume it's SPA if:
             # - The path doesn't end with .html, .htm, .php, etc.
             # - The current page is already loaded (not the initial navigation)
-            static_extensions = {".html", ".htm", ".php", ".asp", ".jsp"}
             target_path = target.path.lower()
 
-            if any(target_path.endswith(ext) for ext in static_extensions):
+            if target_path.endswith(STATIC_DOCUMENT_EXTENSIONS):
                 return False  # Likely a real document
 
             # Assume same-origin path change without static extension is SPA
             return True
 
-        except Exception as exc:
+        except (TypeError, AttributeError, ValueError) as exc:
             logger.warning("Error checking SPA route change: %s", exc)
             return False
 
@@ -312,7 +408,7 @@ class TaskStepExecutor:
             # Give the SPA time to react to the route change
             await asyncio.sleep(0.3)
 
-        except Exception as exc:
+        except PlaywrightError as exc:
             logger.warning(
                 "Failed SPA navigation to %s: %s, falling back to goto", url, exc
             )
@@ -323,87 +419,122 @@ class TaskStepExecutor:
         try:
             logger.info("Navigating to %s", url)
             await page.goto(url, wait_until="domcontentloaded")
-        except Exception as exc:
+        except PlaywrightError as exc:
             logger.warning("Failed to navigate to %s: %s", url, exc)
 
     async def _safe_wait_for_load(self, page: Page, state: str) -> None:
         try:
             await page.wait_for_load_state(state, timeout=15000)  # type: ignore
-        except Exception as exc:
+        except PlaywrightError as exc:
             logger.debug("Load wait for %s skipped: %s", state, exc)
 
     def _extract_coordinates(
         self, payload: Dict[str, Any]
     ) -> Optional[Tuple[float, float]]:
-        coords: Any = payload.get("coordinates") if isinstance(payload, dict) else None
+        coords: Any = payload.get("coordinates")
+        point: Optional[Tuple[float, float]]
         if isinstance(coords, dict):
             for key in ("client", "page", "offset"):
-                point: Any = coords.get(key)
-                if self._is_valid_point(point):
-                    return float(point["x"]), float(point["y"])
-            relative: Any = coords.get("relative")
-            viewport: Any = coords.get("viewport") or payload.get("viewport")
-            if (
-                self._is_valid_point(relative)
-                and isinstance(viewport, dict)
-                and isinstance(viewport.get("width"), (int, float))
-                and isinstance(viewport.get("height"), (int, float))
-            ):
-                return (
-                    float(relative["x"]) * float(viewport["width"]),
-                    float(relative["y"]) * float(viewport["height"]),
-                )
-        x: Any = payload.get("x") if isinstance(payload, dict) else None
-        y: Any = payload.get("y") if isinstance(payload, dict) else None
-        if isinstance(x, (int, float)) and isinstance(y, (int, float)):
-            return float(x), float(y)
-        rect: Any = payload.get("elementRect") if isinstance(payload, dict) else None
+                point = self._to_point(coords.get(key))
+                if point is not None:
+                    return point
+            relative = self._to_point(coords.get("relative"))
+            viewport = self._to_point(
+                coords.get("viewport") or payload.get("viewport"), "width", "height"
+            )
+            if relative is not None and viewport is not None:
+                return relative[0] * viewport[0], relative[1] * viewport[1]
+        point = self._to_point(payload)
+        if point is not None:
+            return point
+        rect: Any = payload.get("elementRect")
         if isinstance(rect, dict):
-            left: Any = rect.get("left")
-            top: Any = rect.get("top")
-            width: Any = rect.get("width", 0)
-            height: Any = rect.get("height", 0)
-            if isinstance(left, (int, float)) and isinstance(top, (int, float)):
-                return float(left + width / 2), float(top + height / 2)
+            try:
+                left: float = float(rect["left"])
+                top: float = float(rect["top"])
+                width: float = float(rect.get("width", 0))
+                height: float = float(rect.get("height", 0))
+            except (TypeError, KeyError, ValueError):
+                return None
+            return left + width / 2, top + height / 2
         return None
 
     def _build_selector(self, payload: Dict[str, Any]) -> Optional[str]:
-        element_id: Any = payload.get("id") if isinstance(payload, dict) else None
+        element_id: Any = payload.get("id")
         if element_id:
             return f"#{self._css_escape(str(element_id))}"
-        class_name: Any = (
-            payload.get("className") if isinstance(payload, dict) else None
-        )
-        tag: Any = payload.get("tag") if isinstance(payload, dict) else None
+        class_name: Any = payload.get("className")
+        tag: Any = payload.get("tag")
         if class_name:
-            classes: list[str] = [
-                self._css_escape(part) for part in str(class_name).split() if part
-            ]
+            # str.split() never yields empty parts, so escape and join in one pass
+            classes: str = "".join(
+                "." + self._css_escape(part) for part in str(class_name).split()
+            )
             if classes:
                 prefix: str = (tag or "*").lower() if tag else "*"
-                return f"{prefix}{''.join('.' + cls for cls in classes)}"
+                return f"{prefix}{classes}"
         return None
 
+    def _is_noop_step(self, step: StepModel, payload: Any) -> bool:
+        """
+        Whether replaying the step would do nothing (no handler or missing data).
+
+        This is also the single place where payloads are checked to be dicts, the
+        step handlers assume they only ever receive dict payloads.
+        """
+        category, subject, action = _split_event_type(step.event_type)
+        if category == "state":
+            handled: bool = (subject, action) in self._state_steps
+        else:
+            handled = (category, subject) == ("action", "user") and (
+                action in self._user_actions
+            )
+        if not handled:
+            return True
+
+        if not isinstance(payload, dict):
+            return True
+        if (subject, action) == ("browser", "navigated"):
+            url: Any = payload.get("url")
+            return not isinstance(url, str) or not url or url == "about:blank"
+        if category == "state":
+            return False
+        if action == "hover":
+            return self._extract_coordinates(payload) is None
+        if action == "input":
+            return payload.get("value") is None
+        if action == "keydown":
+            return not payload.get("key")
+        return False
+
     @staticmethod
-    def _is_valid_point(point: Any) -> bool:
-        return (
-            isinstance(point, dict)
-            and isinstance(point.get("x"), (int, float))
-            and isinstance(point.get("y"), (int, float))
-        )
+    def _coalesce_bursts(trajectory: list[ReplayStep]) -> list[ReplayStep]:
+        """Keep only the last step of each run of consecutive scroll steps."""
+        compacted: list[ReplayStep] = []
+        for item in trajectory:
+            event_type: str = item[0].event_type
+            if (
+                compacted
+                and event_type in COALESCED_EVENT_TYPES
+                and compacted[-1][0].event_type == event_type
+            ):
+                compacted[-1] = item
+            else:
+                compacted.append(item)
+        return compacted
 
     @staticmethod
-    def _css_escape(value: str) -> str:
-        return "".join(CSS_ESCAPE_MAP.get(ch, ch) for ch in value)
+    def _to_point(
+        value: Any, x_key: str = "x", y_key: str = "y"
+    ) -> Optional[Tuple[float, float]]:
+        try:
+            return float(value[x_key]), float(value[y_key])
+        except (TypeError, KeyError, ValueError):
+            return None
 
     @staticmethod
-    def _split_event_type(event_type: str) -> Tuple[str, str, str]:
-        parts = (event_type or "").split(":", 2)
-        if len(parts) == 1:
-            return parts[0], "", ""
-        if len(parts) == 2:
-            return parts[0], parts[1], ""
-        return parts[0], parts[1], parts[2]
+    def _css_escape(value: str) -> str:
+        return value.translate(CSS_ESCAPE_TABLE)
 
     @staticmethod
     def _urls_differ(current: Optional[str], target: str) -> bool:
@@ -424,3 +555,15 @@ CSS_ESCAPE_MAP = {
     "#": "\\#",
     ":": "\\:",
 }
+CSS_ESCAPE_TABLE = str.maketrans(CSS_ESCAPE_MAP)
+
+# Path suffixes that indicate a real document rather than a client-side route
+STATIC_DOCUMENT_EXTENSIONS = (".html", ".htm", ".php", ".asp", ".jsp")
+
+# Pause after each replayed user action, pointer moves need less settling time
+ACTION_DELAYS = {"hover": 0.05}
+
+# Bursts of these steps only matter for their final position when replayed. Hovers
+# are not samples (the page script only emits one after dwelling on a new element),
+# so intermediate ones can reveal menus later steps depend on
+COALESCED_EVENT_TYPES = {"action:user:scroll"}